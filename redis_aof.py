@@ -0,0 +1,113 @@
+# Append-only command log.
+#
+# Every mutation the store applies is appended as a RESP-framed command, so
+# the dataset can be rebuilt after a restart by loading the last SAVE
+# snapshot and replaying the log on top of it. Commands are only copied into
+# an in-memory buffer on the request path; a background thread writes the
+# buffer out and fdatasyncs the file about once per interval (Redis's
+# "appendfsync everysec"), so command latency doesn't depend on the disk.
+
+import os
+import time
+import logging
+import threading
+
+from redis_protocol import RequestParser, ProtocolError, encode_command
+
+FSYNC_INTERVAL = 1.0 # Seconds between fdatasync calls while commands are being logged
+
+log = logging.getLogger("pyredis.aof")
+
+fdatasync = getattr(os, 'fdatasync', os.fsync) # fdatasync is missing on macOS
+
+class AppendOnlyLog:
+    def __init__(self, path, fsync_interval=FSYNC_INTERVAL):
+        """Opens (or creates) the log at path and starts its writer thread."""
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._fsync_interval = fsync_interval
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+        # Held by the writer while it touches the file. truncate() takes it
+        # inside _cond; the writer never takes _cond while holding it.
+        self._file_lock = threading.Lock()
+        # Bumped by truncate(), so a buffer the writer swapped out before the
+        # truncation is discarded instead of landing in the fresh log.
+        self._epoch = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="pyredis-aof", daemon=True)
+        self._thread.start()
+
+    def append(self, *args):
+        """Queues one command for the writer thread."""
+        frame = encode_command(*args)
+        with self._cond:
+            self._buffer += frame
+            self._cond.notify()
+
+    def truncate(self):
+        """Empties the log, dropping queued commands too, e.g. once a snapshot has captured everything in it."""
+        with self._cond, self._file_lock:
+            self._buffer = bytearray()
+            self._epoch += 1
+            os.ftruncate(self._fd, 0)
+            fdatasync(self._fd)
+
+    def close(self):
+        """Writes out and syncs every queued command, then closes the file."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        os.close(self._fd)
+
+    def _run(self):
+        """Writer thread: swaps out the buffer, writes it, and syncs at most once per interval."""
+        unsynced = False
+        last_sync = time.monotonic()
+        while True:
+            with self._cond:
+                if not self._buffer and not self._closed:
+                    self._cond.wait(max(0, last_sync + self._fsync_interval - time.monotonic()) if unsynced else None)
+                pending, self._buffer = self._buffer, bytearray()
+                epoch = self._epoch
+                closed = self._closed
+            try:
+                with self._file_lock:
+                    if pending and epoch == self._epoch:
+                        self._write(pending)
+                        unsynced = True
+                    if unsynced and (closed or time.monotonic() - last_sync >= self._fsync_interval):
+                        fdatasync(self._fd)
+                        unsynced = False
+                        last_sync = time.monotonic()
+            except OSError as e:
+                log.error("Error writing append-only log '%s': %s", self.path, e)
+            if closed:
+                return
+
+    def _write(self, data):
+        """Writes all of data, retrying after short writes."""
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+
+def read_log(path):
+    """Yields the arguments of each complete command in the log. Whatever follows the last complete command, e.g. a command torn by a crash mid-write, is cut off the file, so commands appended later follow a complete one."""
+    parser = RequestParser()
+    consumed = 0 # Bytes read so far
+    complete = 0 # End of the last complete command
+    try:
+        with open(path, 'rb') as f:
+            while chunk := f.read(1 << 16):
+                consumed += len(chunk)
+                parser.feed(chunk)
+                while (request := parser.next_request()) is not None:
+                    complete = consumed - parser.pending_bytes
+                    yield request[0]
+    except ProtocolError as e:
+        log.error("Stopped replaying '%s' at byte %d, which does not start a valid command: %s", path, complete, e)
+    size = os.path.getsize(path)
+    if size > complete:
+        log.warning("Cutting %d bytes after the last complete command off '%s'.", size - complete, path)
+        os.truncate(path, complete)
@@ -0,0 +1,201 @@
+# Wire protocol helpers shared by the server and its tests.
+#
+# Requests arrive in one of two framings, told apart by their first byte:
+#   RESP arrays of bulk strings, as sent by redis-cli and Redis client libraries:
+#       *3\r\n$3\r\nSET\r\n$5\r\nmykey\r\n$7\r\nmyvalue\r\n
+#     Every argument carries its byte length, so arguments may contain spaces,
+#     newlines or binary data and the parser never scans payload bytes.
+#   Inline commands: a single whitespace-separated line, as typed into
+#   redis_client.py:
+#       SET mykey myvalue\n
+#
+# Replies go back in the framing the request used: RESP replies for RESP
+# requests, and the original human-readable text lines for inline requests.
+
+MAX_INLINE_LENGTH = 1 << 20 # Longest inline command line accepted
+MAX_BULK_LENGTH = 512 << 20 # Largest single RESP argument accepted
+MAX_ARGUMENTS = 1 << 20 # Most arguments accepted in one RESP array
+
+ERROR_PREFIX = "ERROR: "
+
+INLINE_NIL = b'Nil\n'
+RESP_NIL = b'$-1\r\n'
+
+class ProtocolError(Exception):
+    """Raised when a client sends bytes that cannot be framed as a request."""
+
+class ErrorReply(str):
+    """A command result that reports an error, told apart from stored values by its type, never by its text. The text keeps the ERROR_PREFIX that inline clients are shown."""
+    __slots__ = ()
+
+def _decode(view):
+    """Decodes an argument, keeping undecodable bytes round-trippable."""
+    return str(view, 'utf-8', 'surrogateescape')
+
+def _encode(text):
+    return text.encode('utf-8', 'surrogateescape')
+
+class RequestParser:
+    def __init__(self):
+        """Initializes an empty receive buffer."""
+        self._buffer = bytearray()
+        self._pos = 0 # Start of the first request not yet returned
+        # Parsing of an incomplete request resumes where the last attempt stopped
+        # instead of rescanning it from the start on every read, which would be
+        # quadratic for a large value arriving in many small chunks.
+        self._resume = 0 # Next byte to scan: inline newline search or RESP argument header
+        self._args = None # Arguments decoded so far of a partially received RESP array
+        self._missing = 0 # Arguments of that array still to be received
+        self._need = 0 # Buffer length at which a pending bulk argument is complete
+
+    def feed(self, data):
+        """Appends received bytes, first discarding the requests already returned."""
+        if self._pos:
+            del self._buffer[:self._pos]
+            self._resume -= self._pos
+            self._need -= self._pos
+            self._pos = 0
+        self._buffer += data
+
+    def next_request(self):
+        """Returns (args, is_resp) for the next complete request, or None if more bytes are needed."""
+        buffer = self._buffer
+        if len(buffer) < self._need:
+            return None
+        while self._pos < len(buffer):
+            with memoryview(buffer) as view:
+                if self._args is not None or buffer[self._pos] == 0x2A: # '*'
+                    request = self._parse_array(buffer, view)
+                else:
+                    request = self._parse_inline(buffer, view)
+            if request is None:
+                return None
+            self._resume = self._pos
+            if request[0]:
+                return request
+            # Blank lines and empty arrays are skipped, as Redis does.
+        return None
+
+    @property
+    def bytes_needed(self):
+        """Bytes still missing from a partially received bulk argument of known length, else 0."""
+        return max(0, self._need - len(self._buffer))
+
+    @property
+    def pending_bytes(self):
+        """Number of buffered bytes after the last request returned."""
+        return len(self._buffer) - self._pos
+
+    def _parse_array(self, buffer, view):
+        if self._args is None:
+            count, pos = self._read_length(buffer, self._pos, MAX_ARGUMENTS)
+            if count is None:
+                return None
+            self._args = []
+            self._missing = count
+            self._resume = pos
+        args = self._args
+        pos = self._resume
+        while self._missing:
+            if pos >= len(buffer):
+                return None
+            if buffer[pos] != 0x24: # '$'
+                raise ProtocolError(f"expected '$', got {chr(buffer[pos])!r}")
+            size, start = self._read_length(buffer, pos, MAX_BULK_LENGTH)
+            if size is None:
+                return None
+            end = start + size
+            if end + 2 > len(buffer):
+                self._need = end + 2
+                return None
+            if buffer[end:end + 2] != b'\r\n':
+                raise ProtocolError("bulk string is not terminated by CRLF")
+            args.append(_decode(view[start:end]))
+            pos = self._resume = end + 2
+            self._missing -= 1
+        self._args = None
+        self._pos = pos
+        return args, True
+
+    def _read_length(self, buffer, pos, limit):
+        """Parses a '*<n>\\r\\n' or '$<n>\\r\\n' header at pos. Returns (n, next_pos), or (None, pos) if incomplete."""
+        eol = buffer.find(b'\r\n', pos)
+        if eol < 0:
+            if len(buffer) - pos > 32:
+                raise ProtocolError("length header is too long")
+            return None, pos
+        try:
+            length = int(buffer[pos + 1:eol])
+        except ValueError:
+            raise ProtocolError("invalid length header") from None
+        if buffer[pos] == 0x2A and length < 0:
+            length = 0 # '*-1' is a null array; treat it like an empty one
+        if not 0 <= length <= limit:
+            raise ProtocolError(f"invalid length {length}")
+        return length, eol + 2
+
+    def _parse_inline(self, buffer, view):
+        eol = buffer.find(b'\n', self._resume)
+        if eol < 0:
+            if len(buffer) - self._pos > MAX_INLINE_LENGTH:
+                raise ProtocolError(f"inline command exceeds {MAX_INLINE_LENGTH} bytes")
+            self._resume = len(buffer)
+            return None
+        args = _decode(view[self._pos:eol]).split()
+        self._pos = eol + 1
+        return args, False
+
+# Reply encoders keyed by exact result type: one dict lookup picks the
+# encoder instead of a cascade of isinstance checks. Strings, the most
+# common result, are tested first.
+_INLINE_ENCODERS = {
+    type(None): lambda response: INLINE_NIL,
+    int: lambda response: b'(integer) %d\n' % response,
+    bool: lambda response: b'(integer) %d\n' % response,
+    list: lambda response: _encode(str(response)) + b'\n',
+    ErrorReply: lambda response: _encode(response) + b'\n',
+}
+
+_RESP_ENCODERS = {
+    type(None): lambda response: RESP_NIL,
+    int: lambda response: b':%d\r\n' % response,
+    bool: lambda response: b':%d\r\n' % response,
+    list: lambda response: b'*%d\r\n' % len(response) + b''.join(encode_resp_reply(item) for item in response),
+    ErrorReply: lambda response: encode_resp_error(response[len(ERROR_PREFIX):] if response.startswith(ERROR_PREFIX) else response),
+}
+
+def encode_inline_reply(response):
+    """Renders a command result as the text line inline clients expect."""
+    if type(response) is str:
+        return _encode(response) + b'\n'
+    encoder = _INLINE_ENCODERS.get(type(response))
+    if encoder is not None:
+        return encoder(response)
+    return _encode(str(response)) + b'\n'
+
+def encode_resp_reply(response, status=False):
+    """Renders a command result as a RESP reply. Strings become simple-string replies when status is set, and ErrorReply results error replies."""
+    if type(response) is str:
+        if status:
+            return b'+' + _encode(response) + b'\r\n'
+        payload = _encode(response)
+        return b'$%d\r\n%s\r\n' % (len(payload), payload)
+    encoder = _RESP_ENCODERS.get(type(response))
+    if encoder is not None:
+        return encoder(response)
+    return encode_resp_reply(str(response), status)
+
+def encode_resp_error(message):
+    """Renders an error reply, adding the generic ERR code unless the message starts with its own (e.g. WRONGTYPE)."""
+    code = message.split(' ', 1)[0]
+    if not (code.isalpha() and code.isupper()):
+        message = "ERR " + message
+    return b'-' + _encode(message.replace('\r', ' ').replace('\n', ' ')) + b'\r\n'
+
+def encode_command(*args):
+    """Frames a command as a RESP array of bulk strings."""
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        payload = _encode(str(arg))
+        parts.append(b'$%d\r\n%s\r\n' % (len(payload), payload))
+    return b''.join(parts)
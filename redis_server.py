@@ -1,203 +1,288 @@
-import socket
-import threading
-import pickle
+import asyncio
+import logging
+import json
 import os
+from collections import deque
 
-from redis_store import PyRedisStore
+from redis_store import PyRedisStore, OK
+from redis_aof import AppendOnlyLog, read_log, fdatasync
+from redis_protocol import RequestParser, ProtocolError, ErrorReply, encode_inline_reply, encode_resp_reply, encode_resp_error
 
-# Simple Protocol: Commands are space-separated, newline terminated.
-# Examples:
+# Protocol: clients send either RESP arrays (redis-cli, Redis client libraries)
+# or inline space-separated, newline-terminated commands (redis_client.py).
+# Examples of inline commands:
 # SET mykey myvalue\n
 # GET mykey\n
 # LPUSH mylist val1 val2\n
-
-# Response Format:
-# Simple strings for OK/errors, prefixed length for bulk strings, etc.
-# For simplicity, I am just sending back the string representation of the result.
-# A real Redis uses the RESP protocol (REdis Serialization Protocol).
+# Each reply uses the framing of its request; see redis_protocol.py.
 
 DEFAULT_PORT = 6380 # Using a different port than default Redis (6379)
 DEFAULT_HOST = '127.0.0.1' # Listen only on localhost by default
-DUMP_FILENAME = "pyredis_dump.pkl"
+DUMP_FILENAME = "pyredis_dump.json"
+AOF_FILENAME = "pyredis_appendonly.aof" # Mutations since the last SAVE
+READ_SIZE = 8192 # Minimum bytes requested from the socket per read
+DRAIN_THRESHOLD = 1 << 16 # Pending reply bytes before waiting for a slow reader
+ACTIVE_EXPIRE_INTERVAL = 0.1 # Seconds between active expiry sweeps
+ACTIVE_EXPIRE_BUDGET = 20 # Most keys evicted per sweep before yielding to clients
+
+# Dump format: a JSON array [data, expirations]. Strings, lists and hashes map
+# onto JSON strings, arrays and objects, so values need no type tags; lists are
+# turned back into deques on load. Non-UTF-8 bytes (kept as lone surrogates)
+# survive as \udcXX escapes. Expirations are Unix-time deadlines in ms.
+
+PONG = "PONG"
+# Pre-encoded (RESP, inline) replies for results that are always the same
+# object, recognized by identity so they are never re-encoded.
+OK_REPLIES = (b'+OK\r\n', b'OK\n')
+PONG_REPLIES = (b'+PONG\r\n', b'PONG\n')
 
-store = PyRedisStore()
-store_lock = threading.Lock()
+# Per-command traces are logged at DEBUG, so with the default INFO level they
+# cost one level check each and their messages are never formatted. They sit
+# under `if __debug__:`, so running with `python -O` removes them altogether.
+log = logging.getLogger("pyredis.server")
+
+# Every command runs on the event loop thread (the AOF writer thread never
+# touches the store), so the store's locks are switched off.
+store = PyRedisStore(thread_safe=False)
+store_get = store.make_get() # GET is the hottest command; see PyRedisStore.make_get
+append_log = None # AppendOnlyLog attached to the store while serving
 
 def load_data_from_disk():
-    """Loads data from the pickle dump file if it exists."""
-    global store
+    """Loads data from the JSON dump file if it exists."""
     if os.path.exists(DUMP_FILENAME):
-        print(f"[Server] Found dump file '{DUMP_FILENAME}'. Loading data...")
+        log.info("Found dump file '%s'. Loading data...", DUMP_FILENAME)
         try:
             with open(DUMP_FILENAME, 'rb') as f:
-                with store_lock:
-                     loaded_data = pickle.load(f)
-                     if isinstance(loaded_data, tuple) and len(loaded_data) == 2 and isinstance(loaded_data[0], dict) and isinstance(loaded_data[1], dict):
-                         store._data = loaded_data[0]
-                         store._expirations = loaded_data[1]
-                         print(f"[Server] Successfully loaded {len(store._data)} keys from disk.")
-                         for key in list(store._data.keys()):
-                             store._check_expiry(key)
-                         print("[Server] Performed initial expiry check on loaded data.")
-                     else:
-                         print("[Server] Error: Dump file format incorrect. Starting empty.")
-                         store = PyRedisStore()
-        except (pickle.UnpicklingError, EOFError, TypeError, Exception) as e:
-            print(f"[Server] Error loading data from '{DUMP_FILENAME}': {e}. Starting empty.")
-            store = PyRedisStore()
+                loaded_data = json.loads(f.read())
+            if isinstance(loaded_data, list) and len(loaded_data) == 2 and isinstance(loaded_data[0], dict) and isinstance(loaded_data[1], dict):
+                log.info("Successfully loaded %d keys from disk.", len(loaded_data[0]))
+                data = {key: deque(value) if type(value) is list else value for key, value in loaded_data[0].items()}
+                store.restore(data, loaded_data[1])
+                log.info("Performed initial expiry check on loaded data.")
+            else:
+                log.error("Dump file format incorrect. Starting empty.")
+        except (ValueError, TypeError, Exception) as e:
+            log.error("Error loading data from '%s': %s. Starting empty.", DUMP_FILENAME, e)
     else:
-        print(f"[Server] Dump file '{DUMP_FILENAME}' not found. Starting empty.")
+        log.info("Dump file '%s' not found. Starting empty.", DUMP_FILENAME)
+
+def load_log_from_disk():
+    """Replays the append-only log of mutations made since the last SAVE, if it exists."""
+    if not os.path.exists(AOF_FILENAME):
+        log.info("Append-only log '%s' not found. Nothing to replay.", AOF_FILENAME)
+        return
+    replayed = 0
+    # Nothing may expire mid-replay: a key the log pushes to again before its
+    # deadline must keep the values logged earlier. The clock is pinned before
+    # every deadline, and keys whose deadline has passed are removed by expiry
+    # once serving starts.
+    with store.tick(now_ms=-(1 << 62)):
+        for parts in read_log(AOF_FILENAME):
+            execute_command(command_name(parts[0]), parts[1:])
+            replayed += 1
+    log.info("Replayed %d commands from '%s'.", replayed, AOF_FILENAME)
 
 def save_data_to_disk():
-    """Saves the current data and expirations to the pickle dump file."""
-    print(f"[Server] Attempting to save data to '{DUMP_FILENAME}'...")
-    with store_lock:
+    """Saves the current data and expirations to the JSON dump file, then empties the append-only log it supersedes."""
+    log.info("Attempting to save data to '%s'...", DUMP_FILENAME)
+    with store.locked():
         try:
-            data_to_save = (store._data, store._expirations)
-            with open(DUMP_FILENAME, 'wb') as f:
-                pickle.dump(data_to_save, f)
-            print(f"[Server] Data successfully saved.")
+            data_to_save = (store._data, store.wall_clock_expirations())
+            payload = json.dumps(data_to_save, separators=(',', ':'), default=list).encode('ascii')
+            # Written to a temporary file and renamed over the old dump only
+            # once it is on disk, so a crash mid-save leaves the previous
+            # snapshot intact rather than a truncated one.
+            tmp_filename = DUMP_FILENAME + ".tmp"
+            try:
+                with open(tmp_filename, 'wb') as f:
+                    f.write(payload)
+                    f.flush()
+                    fdatasync(f.fileno())
+                os.replace(tmp_filename, DUMP_FILENAME)
+            except BaseException:
+                try:
+                    os.unlink(tmp_filename)
+                except OSError:
+                    pass
+                raise
+            if append_log is not None:
+                append_log.truncate()
+            log.info("Data successfully saved.")
             return "OK. Data saved successfully."
         except Exception as e:
-            print(f"[Server] Error saving data: {e}")
-            return f"ERROR: Could not save data: {e}"
+            log.error("Error saving data: %s", e)
+            return ErrorReply(f"ERROR: Could not save data: {e}")
+
+def _command_set(args):
+    """SET key value [EX milliseconds]"""
+    if len(args) == 2:
+        return store.command_set(args[0], args[1])
+    if len(args) == 4 and args[2].upper() == "EX":
+        return store.command_set_ex(args[0], args[1], args[3])
+    return ErrorReply("ERROR: wrong number of arguments for 'set' command")
+
+# Dispatch table: command name -> (handler(args), min args, max args or None if variadic).
+COMMANDS = {
+    "SET": (_command_set, 2, 4),
+    "GET": (lambda args: store_get(args[0]), 1, 1),
+    "MSET": (lambda args: store.command_mset(*args), 2, None),
+    "MGET": (lambda args: store.command_mget(*args), 1, None),
+    "DEL": (lambda args: store.command_del(*args), 1, None),
+    "LPUSH": (lambda args: store.command_lpush(args[0], *args[1:]), 2, None),
+    "RPUSH": (lambda args: store.command_rpush(args[0], *args[1:]), 2, None),
+    "LRANGE": (lambda args: store.command_lrange(args[0], args[1], args[2]), 3, 3),
+    "HSET": (lambda args: store.command_hset(args[0], args[1], args[2]), 3, 3),
+    "HGET": (lambda args: store.command_hget(args[0], args[1]), 2, 2),
+    "HDEL": (lambda args: store.command_hdel(args[0], *args[1:]), 2, None),
+    "TTL": (lambda args: store.command_ttl(args[0]), 1, 1),
+    "EXPIRE": (lambda args: store.command_expire(args[0], args[1]), 2, 2),
+    "PEXPIREAT": (lambda args: store.command_pexpireat(args[0], args[1]), 2, 2),
+    "PING": (lambda args: PONG, 0, 0),
+    "SAVE": (lambda args: save_data_to_disk(), 0, 0),
+    "COMMAND": (lambda args: "Commands: " + ", ".join(COMMANDS), 0, None),
+    "QUIT": (lambda args: OK, 0, None),
+}
+
+# Commands whose successful string results are RESP simple strings (+OK) rather than bulk strings.
+STATUS_REPLY_COMMANDS = frozenset({"SET", "MSET", "PING", "SAVE", "QUIT"})
+
+def command_name(token):
+    """Returns the uppercase name of a command token. Names clients already send uppercased are found as-is, without an upper() copy."""
+    return token if token in COMMANDS else token.upper()
+
+def execute_command(command, args):
+    """Runs an uppercased command through the dispatch table and returns its raw result."""
+    entry = COMMANDS.get(command)
+    if entry is None:
+        return ErrorReply(f"ERROR: Unknown command '{command}'")
+    handler, min_args, max_args = entry
+    if len(args) < min_args or (max_args is not None and len(args) > max_args):
+        return ErrorReply(f"ERROR: wrong number of arguments for '{command.lower()}' command")
+    return handler(args)
 
-def handle_connection(conn, addr):
+def process_requests(parser, addr):
+    """Runs every complete request buffered in the parser. Returns (encoded replies, whether to close the connection)."""
+    replies = []
+    # The whole batch shares one clock reading. Nothing in here awaits, so no
+    # other connection runs while the store's clock is pinned.
+    with store.tick():
+        while True:
+            try:
+                request = parser.next_request()
+            except ProtocolError as e:
+                log.warning("Protocol error from %s: %s", addr, e)
+                replies.append(encode_resp_error(f"Protocol error: {e}"))
+                return replies, True
+            if request is None:
+                return replies, False
+
+            parts, is_resp = request
+            if __debug__:
+                log.debug("Received from %s: %s", addr, parts)
+            command = command_name(parts[0])
+            args = parts[1:]
+            try:
+                response = execute_command(command, args)
+            except Exception as e:
+                log.exception("Error executing command %s", parts)
+                response = ErrorReply("ERROR: Internal server error")
+
+            if response is OK:
+                replies.append(OK_REPLIES[not is_resp])
+            elif response is PONG:
+                replies.append(PONG_REPLIES[not is_resp])
+            elif is_resp:
+                replies.append(encode_resp_reply(response, status=command in STATUS_REPLY_COMMANDS))
+            else:
+                replies.append(encode_inline_reply(response))
+            # %.100r truncates the reply only if the record is emitted.
+            if __debug__:
+                log.debug("Sending to %s: %.100r", addr, replies[-1])
+            if command == "QUIT":
+                log.debug("QUIT received, closing connection to %s", addr)
+                return replies, True
+
+async def handle_connection(reader, writer):
     """Handles a single client connection."""
-    print(f"[Server] Connection accepted from {addr}")
-    buffer = ""
+    addr = writer.get_extra_info('peername')
+    log.debug("Connection accepted from %s", addr)
+    parser = RequestParser()
     try:
         while True:
-            data = conn.recv(1024)
+            # Every complete request in the buffer has been handled; only now go
+            # back to the socket, asking for at least the rest of a half-received
+            # value so that large values don't take one read per READ_SIZE chunk.
+            data = await reader.read(max(READ_SIZE, parser.bytes_needed))
             if not data:
-                print(f"[Server] Connection closed by {addr}")
+                log.debug("Connection closed by %s", addr)
                 break
 
-            buffer += data.decode('utf-8')
-
-            while '\n' in buffer:
-                command_line, buffer = buffer.split('\n', 1)
-                command_line = command_line.strip()
-                if not command_line: continue
-
-                print(f"[Server] Received from {addr}: {command_line}")
-                parts = command_line.split()
-                if not parts: continue
-
-                command = parts[0].upper()
-                args = parts[1:]
-                response = None
-                if command == "SAVE":
-                    if not args:
-                        response = save_data_to_disk()
-                    else:
-                        response = "ERROR: 'save' command takes no arguments"
-                elif command == "QUIT":
-                    pass
-                elif command == "PING":
-                    if not args:
-                        response = "PONG"
-                    else:
-                        response = "ERROR: 'ping' command takes no arguments"
-                elif command == "COMMAND":
-                     response = "Commands: SET, GET, DEL, LPUSH, RPUSH, LRANGE, HSET, HGET, HDEL, TTL, EXPIRE, PING, SAVE, COMMAND, QUIT"
-                else:
-                    try:
-                        with store_lock:
-                            if command == "SET":
-                                if len(args) == 2: response = store.command_set(args[0], args[1])
-                                elif len(args) == 4 and args[2].upper() == "EX": response = store.command_set(args[0], args[1], expire_ms=args[3])
-                                else: response = "ERROR: wrong number of arguments for 'set' command"
-                            elif command == "GET":
-                                if len(args) == 1: response = store.command_get(args[0])
-                                else: response = "ERROR: wrong number of arguments for 'get' command"
-                            elif command == "DEL":
-                                if len(args) >= 1: response = store.command_del(*args)
-                                else: response = "ERROR: wrong number of arguments for 'del' command"
-                            elif command == "LPUSH":
-                                if len(args) >= 2: response = store.command_lpush(args[0], *args[1:])
-                                else: response = "ERROR: wrong number of arguments for 'lpush' command"
-                            elif command == "RPUSH":
-                                if len(args) >= 2: response = store.command_rpush(args[0], *args[1:])
-                                else: response = "ERROR: wrong number of arguments for 'rpush' command"
-                            elif command == "LRANGE":
-                                if len(args) == 3: response = store.command_lrange(args[0], args[1], args[2])
-                                else: response = "ERROR: wrong number of arguments for 'lrange' command"
-                            elif command == "HSET":
-                                if len(args) == 3: response = store.command_hset(args[0], args[1], args[2])
-                                else: response = "ERROR: wrong number of arguments for 'hset' command"
-                            elif command == "HGET":
-                                if len(args) == 2: response = store.command_hget(args[0], args[1])
-                                else: response = "ERROR: wrong number of arguments for 'hget' command"
-                            elif command == "HDEL":
-                                if len(args) >= 2: response = store.command_hdel(args[0], *args[1:])
-                                else: response = "ERROR: wrong number of arguments for 'hdel' command"
-                            elif command == "TTL":
-                                if len(args) == 1: response = store.command_ttl(args[0])
-                                else: response = "ERROR: wrong number of arguments for 'ttl' command"
-                            elif command == "EXPIRE":
-                                if len(args) == 2: response = store.command_expire(args[0], args[1])
-                                else: response = "ERROR: wrong number of arguments for 'expire' command"
-                            else:
-                                response = f"ERROR: Unknown command '{command}'"
-                    except Exception as e:
-                        print(f"[Server] Error executing command '{command_line}' under lock: {e}")
-                        response = f"ERROR: Internal server error"
-                if command == "QUIT":
-                     response_str = "OK"
-                     print(f"[Server] Sending to {addr}: {response_str}")
-                     conn.sendall(f"{response_str}\n".encode('utf-8'))
-                     print(f"[Server] QUIT received, closing connection to {addr}")
-                     conn.close()
-                     return
-                response_str = ""
-                if response is None:
-                    response_str = "Nil"
-                elif isinstance(response, list):
-                    #response_str = "\n".join(map(str, response))
-                    response_str = str(response)
-                    if not response_str:
-                         response_str = "(empty list or set)"
-                elif isinstance(response, int):
-                    response_str = f"(integer) {response}"
-                elif isinstance(response, str):
-                    response_str = response
-                else:
-                    print(f"[Server] Warning: Unexpected response type: {type(response)}. Converting to string.")
-                    response_str = str(response)
-
-                print(f"[Server] Sending to {addr}: {response_str[:100]}...")
-                conn.sendall(f"{response_str}\n".encode('utf-8'))
+            parser.feed(data)
+            replies, closing = process_requests(parser, addr)
+            # Replies to every request in this read are handed to the transport
+            # together: one send (sendmsg where supported) per read instead of
+            # one per command for pipelining clients.
+            if replies:
+                writer.writelines(replies)
+            if closing:
+                await writer.drain()
+                return
+            # Only wait for the socket when the client stops reading and
+            # replies pile up; otherwise the transport flushes on its own.
+            if writer.transport.get_write_buffer_size() > DRAIN_THRESHOLD:
+                await writer.drain()
 
     except ConnectionResetError:
-        print(f"[Server] Connection reset by peer {addr}")
+        log.debug("Connection reset by peer %s", addr)
     except Exception as e:
-        print(f"[Server] Error handling connection from {addr}: {e}")
+        log.error("Error handling connection from %s: %s", addr, e)
     finally:
-        print(f"[Server] Cleaning up connection for {addr}")
-        conn.close()
+        log.debug("Cleaning up connection for %s", addr)
+        writer.close()
+
+def active_expire_cycle(loop):
+    """Evicts expired keys nobody is reading, then schedules the next sweep on the loop."""
+    delay = ACTIVE_EXPIRE_INTERVAL
+    try:
+        # A full budget means more keys are probably due: sweep again as soon
+        # as pending client I/O has been served.
+        if store.active_expire(ACTIVE_EXPIRE_BUDGET) >= ACTIVE_EXPIRE_BUDGET:
+            delay = 0
+    except Exception:
+        log.exception("Error during active expiry")
+    finally:
+        loop.call_later(delay, active_expire_cycle, loop)
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Accepts clients on a single-threaded event loop until cancelled."""
+    server = await asyncio.start_server(handle_connection, host, port)
+    loop = asyncio.get_running_loop()
+    loop.call_later(ACTIVE_EXPIRE_INTERVAL, active_expire_cycle, loop)
+    log.info("PyRedis server listening on %s:%s", host, port)
+    async with server:
+        await server.serve_forever()
 
 def run_server(host=DEFAULT_HOST, port=DEFAULT_PORT):
     """Loads data, then starts the PyRedis server."""
+    global append_log
     load_data_from_disk()
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    load_log_from_disk()
+    append_log = AppendOnlyLog(AOF_FILENAME)
+    store.attach_log(append_log)
     try:
-        server_socket.bind((host, port))
-        server_socket.listen(5)
-        print(f"[Server] PyRedis server listening on {host}:{port}")
-        while True:
-            conn, addr = server_socket.accept()
-            thread = threading.Thread(target=handle_connection, args=(conn, addr))
-            thread.daemon = True
-            thread.start()
+        asyncio.run(serve(host, port))
     except OSError as e:
-        print(f"[Server] Error binding to {host}:{port} - {e}")
+        log.error("Error binding to %s:%s - %s", host, port, e)
     except KeyboardInterrupt:
-        print("\n[Server] Shutting down server...")
+        log.info("Shutting down server...")
     finally:
-        print("[Server] Closing server socket.")
-        server_socket.close()
+        store.attach_log(None)
+        append_log.close()
+        log.info("Server stopped.")
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=os.environ.get("PYREDIS_LOG_LEVEL", "INFO").upper(),
+        format="[%(name)s] %(levelname)s: %(message)s",
+    )
     run_server()
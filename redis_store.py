@@ -1,326 +1,760 @@
 import time
+import logging
+import threading
+from array import array
 from collections import deque
+from itertools import islice
+from contextlib import contextmanager
+
+from redis_protocol import ErrorReply
+
+# Number of lock stripes guarding the keyspace. Must be a power of two so a
+# key's stripe can be picked with a mask instead of a modulo.
+LOCK_STRIPES = 64
+# One-second slots in the expiry timing wheel. Must be a power of two; keys
+# due further ahead than one lap wait in their slot for later laps.
+WHEEL_SLOTS = 2048
+# A wheel slot is compacted when scheduling finds it holding at least twice
+# the live entries it kept last time (or this many), so stale entries left
+# by refreshed TTLs can't pile up before the slot's second comes round.
+WHEEL_COMPACT_MIN = 16
+# Deadlines are stored in signed 64-bit wheel columns.
+_DEADLINE_LIMIT = 1 << 63
+
+# Result of commands that succeed without a value. Callers may test for it
+# with `is` to send a pre-encoded reply.
+OK = "OK"
+
+# Error results, built once instead of formatted per failing call.
+_ERR_WRONGTYPE = ErrorReply("ERROR: WRONGTYPE Operation against a key holding the wrong kind of value")
+_ERR_NOT_INTEGER = ErrorReply("ERROR: value is not an integer or out of range")
+_ERR_EXPIRE_FORMAT = ErrorReply("ERROR: Invalid expiration time format.")
+_ERR_MSET_ARGS = ErrorReply("ERROR: wrong number of arguments for 'mset' command")
+_ERR_LPUSH_ARGS = ErrorReply("ERROR: wrong number of arguments for 'lpush' command")
+_ERR_RPUSH_ARGS = ErrorReply("ERROR: wrong number of arguments for 'rpush' command")
+_ERR_HDEL_ARGS = ErrorReply("ERROR: wrong number of arguments for 'hdel' command")
+
+# Per-command traces sit under `if __debug__:`, so `python -O` compiles them
+# out entirely; otherwise they are DEBUG records formatted only when enabled.
+log = logging.getLogger("pyredis.store")
+
+class _NoLock:
+    """Stands in for a lock in stores that are only used from one thread."""
+    __slots__ = ()
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return True
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NO_LOCK = _NoLock()
+
+# Default for dict.pop calls that must tell a missing entry from any stored value.
+_MISSING = object()
+
+# Bound once so clock reads skip the module attribute lookups.
+_monotonic_ns = time.monotonic_ns
+_time_ns = time.time_ns
+
+def _monotonic_ms():
+    """Milliseconds on the monotonic clock, which wall-clock adjustments don't move."""
+    return _monotonic_ns() // 1_000_000
+
+def _wall_clock_offset_ms():
+    """Difference between Unix time and the monotonic clock, in milliseconds."""
+    return _time_ns() // 1_000_000 - _monotonic_ms()
 
 class PyRedisStore:
-    def __init__(self):
-        """Initializes the main data store and expiration tracking."""
+    # Fixed attribute slots: attribute reads on the command paths are
+    # direct slot loads, and instances carry no __dict__.
+    __slots__ = ('_data', '_expirations', '_thread_safe', '_locks', '_get', '_wheel', '_wheel_limits', '_wheel_cursor', '_wheel_lock', '_tick_time', '_aof')
+
+    def __init__(self, thread_safe=True):
+        """Initializes the main data store and expiration tracking. Pass thread_safe=False when only one thread will ever use the store."""
         self._data = {}
+        # Expiry deadlines are integer milliseconds on the monotonic clock.
         self._expirations = {}
-        print("PyRedisStore initialized.")
+        # Commands lock only the stripe(s) owning their keys, so clients touching
+        # unrelated keys don't serialize on one mutex. Single dict operations are
+        # atomic under the GIL; the stripes protect each command's compound
+        # check-then-act sequence on a key. A single-threaded owner, like the
+        # asyncio server (the Redis model), gets no-op locks instead and pays
+        # nothing for synchronization.
+        self._thread_safe = thread_safe
+        if thread_safe:
+            self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        else:
+            self._locks = [_NO_LOCK] * LOCK_STRIPES
+        # Hashed timing wheel driving active expiry: slot
+        # (deadline_ms // 1000) % WHEEL_SLOTS holds a key and its deadline for
+        # every key due in that second, so a sweep only looks at keys whose
+        # second has passed instead of scanning all expiring keys. Each slot
+        # is a pair of parallel columns, a list of keys and an array('q') of
+        # deadlines, so an entry costs a list pointer plus 8 raw bytes rather
+        # than a tuple and an int object.
+        # Entries are never removed when a TTL changes or is cleared: the
+        # deadline doubles as a generation number, and an entry whose deadline
+        # no longer matches _expirations[key] is dropped when its slot is
+        # swept, or compacted once it reaches its size in _wheel_limits.
+        # _wheel_cursor is the next second to sweep. Slots are guarded by
+        # _wheel_lock, taken inside a stripe when scheduling; sweeps release
+        # it before taking stripes.
+        self._wheel = [([], array('q')) for _ in range(WHEEL_SLOTS)]
+        self._wheel_limits = [WHEEL_COMPACT_MIN] * WHEEL_SLOTS
+        self._wheel_cursor = _monotonic_ms() // 1000
+        self._wheel_lock = threading.Lock() if thread_safe else _NO_LOCK
+        # Clock reading pinned by tick() for a batch of commands, else None.
+        self._tick_time = None
+        # AppendOnlyLog recording every mutation, if attached.
+        self._aof = None
+        # GET's body, shared by command_get and make_get.
+        self._get = self._build_get()
+        log.debug("PyRedisStore initialized.")
+
+    def _lock_for(self, key):
+        """Returns the lock stripe guarding the given key."""
+        return self._locks[hash(key) & (LOCK_STRIPES - 1)]
+
+    @contextmanager
+    def _hold_stripes(self, stripes):
+        """Acquires the given stripe indices in ascending order (the global order that prevents deadlocks)."""
+        for index in stripes:
+            self._locks[index].acquire()
+        try:
+            yield
+        finally:
+            for index in reversed(stripes):
+                self._locks[index].release()
+
+    def _locked_keys(self, keys):
+        """Holds the stripes of several keys, each acquired once."""
+        if not self._thread_safe:
+            return _NO_LOCK
+        return self._hold_stripes(sorted({hash(key) & (LOCK_STRIPES - 1) for key in keys}))
+
+    def locked(self):
+        """Holds every lock stripe, e.g. while snapshotting or replacing the whole dataset."""
+        if not self._thread_safe:
+            return _NO_LOCK
+        return self._hold_stripes(range(LOCK_STRIPES))
+
+    @contextmanager
+    def tick(self, now_ms=None):
+        """Pins the store's clock for a batch of commands, e.g. one event-loop iteration: expiry checks inside the block share one timestamp, like Redis's cached server time. now_ms pins a given reading instead."""
+        self._tick_time = _monotonic_ms() if now_ms is None else now_ms
+        try:
+            yield
+        finally:
+            self._tick_time = None
+
+    def _now_ms(self):
+        """Returns the pinned tick time, or reads the clock when no batch is running."""
+        tick_time = self._tick_time
+        return tick_time if tick_time is not None else _monotonic_ms()
+
+    def attach_log(self, aof):
+        """Starts recording mutations to an AppendOnlyLog, or stops when given None."""
+        self._aof = aof
+
+    def _log(self, *args):
+        """Records a mutation in the append-only log, if one is attached. Call with the key's stripe held."""
+        if self._aof is not None:
+            self._aof.append(*args)
+
+    def _log_deadline(self, key, deadline_ms):
+        """Records a key's expiry as an absolute Unix-time deadline, so replaying it later doesn't extend the TTL."""
+        if self._aof is not None:
+            self._aof.append("PEXPIREAT", key, deadline_ms + _wall_clock_offset_ms())
+
+    def wall_clock_expirations(self):
+        """Returns the expiry deadlines as Unix time in milliseconds, the form they are persisted in. Call with the stripes held."""
+        offset = _wall_clock_offset_ms()
+        return {key: deadline + offset for key, deadline in self._expirations.items()}
+
+    def restore(self, data, expirations):
+        """Replaces the whole dataset, e.g. with one loaded from disk. Expirations are Unix-time deadlines in milliseconds; keys already past theirs are dropped."""
+        offset = _wall_clock_offset_ms()
+        # Converted and range-checked before anything is replaced, so a bad
+        # deadline can't leave the store half restored. One too far ahead
+        # for the wheel's 64-bit columns would never come due: the key is
+        # kept without a TTL. One too far back is simply in the past.
+        converted = {}
+        for key, deadline in expirations.items():
+            deadline_ms = int(deadline) - offset
+            if deadline_ms >= _DEADLINE_LIMIT:
+                log.warning("Ignoring out-of-range expiry deadline of key '%s'.", key)
+                continue
+            converted[key] = deadline_ms
+        expirations = converted
+        with self.locked():
+            self._data = data
+            self._expirations = expirations
+            with self._wheel_lock:
+                for keys, deadlines in self._wheel:
+                    keys.clear()
+                    del deadlines[:]
+                self._wheel_limits[:] = [WHEEL_COMPACT_MIN] * WHEEL_SLOTS
+            now_ms = self._now_ms()
+            for key, deadline_ms in list(expirations.items()):
+                if key not in data or deadline_ms < now_ms:
+                    self._delete_key_internal(key)
+                else:
+                    self._schedule(key, deadline_ms)
+
+    def active_expire(self, budget=20):
+        """Deletes up to `budget` keys whose expiry has passed, without waiting for them to be accessed. Returns the number deleted."""
+        now_ms = self._now_ms()
+        now_tick = now_ms // 1000
+        expirations = self._expirations
+        due = []
+        with self._wheel_lock:
+            # After a long idle spell one lap visits every slot.
+            cursor = max(self._wheel_cursor, now_tick - WHEEL_SLOTS)
+            while cursor < now_tick and len(due) < budget:
+                slot_index = cursor & (WHEEL_SLOTS - 1)
+                keys, deadlines = self._wheel[slot_index]
+                kept_keys = []
+                kept_deadlines = array('q')
+                for index, (key, deadline_ms) in enumerate(zip(keys, deadlines)):
+                    if expirations.get(key) != deadline_ms:
+                        continue # Stale: the TTL changed or was removed
+                    if deadline_ms < now_ms:
+                        due.append((key, deadline_ms))
+                        if len(due) == budget:
+                            kept_keys += keys[index + 1:]
+                            kept_deadlines += deadlines[index + 1:]
+                            break
+                    else:
+                        kept_keys.append(key) # Due on a later lap
+                        kept_deadlines.append(deadline_ms)
+                else:
+                    cursor += 1
+                keys[:] = kept_keys
+                deadlines[:] = kept_deadlines
+                self._wheel_limits[slot_index] = 2 * max(len(kept_keys), WHEEL_COMPACT_MIN)
+            self._wheel_cursor = cursor
+        deleted = 0
+        for key, deadline_ms in due:
+            with self._lock_for(key):
+                # Re-checked under the stripe: the key may have been deleted
+                # or given a new TTL (with its own entry) since the slot was read.
+                if expirations.get(key) == deadline_ms:
+                    if __debug__:
+                        log.debug("Key '%s' expired, deleting (active).", key)
+                    self._expire_key(key)
+                    deleted += 1
+        return deleted
+
+    def _schedule(self, key, deadline_ms):
+        """Files a key in the wheel slot of its deadline, or of the cursor if that second was already swept. Call with the key's stripe held."""
+        with self._wheel_lock:
+            tick = max(deadline_ms // 1000, self._wheel_cursor)
+            index = tick & (WHEEL_SLOTS - 1)
+            keys, deadlines = self._wheel[index]
+            if len(keys) >= self._wheel_limits[index]:
+                self._compact_slot(index)
+            # The deadline goes in first: if it overflows the array, the key
+            # column is left untouched and the two stay the same length.
+            deadlines.append(deadline_ms)
+            keys.append(key)
+
+    def _compact_slot(self, index):
+        """Drops a wheel slot's stale entries. The next compaction waits until the slot doubles its live entries, so each scheduled entry pays O(1) for compaction. Call with _wheel_lock held."""
+        keys, deadlines = self._wheel[index]
+        expirations = self._expirations
+        live = [i for i, (key, deadline_ms) in enumerate(zip(keys, deadlines)) if expirations.get(key) == deadline_ms]
+        keys[:] = [keys[i] for i in live]
+        deadlines[:] = array('q', [deadlines[i] for i in live])
+        self._wheel_limits[index] = 2 * max(len(live), WHEEL_COMPACT_MIN)
+
+    def _set_expiry(self, key, deadline_ms):
+        """Records a key's expiry deadline and schedules it for active expiry. Any earlier wheel entry goes stale. Raises OverflowError, leaving the key unchanged, for a deadline beyond 64 bits."""
+        if not -_DEADLINE_LIMIT <= deadline_ms < _DEADLINE_LIMIT:
+            raise OverflowError("expiry deadline out of range")
+        expirations = self._expirations
+        if expirations.get(key) == deadline_ms:
+            return # Refreshed within the same millisecond: the live entry stands
+        # Recorded before the entry is filed, so a sweep or compaction of the
+        # slot running in between sees the new entry as live.
+        expirations[key] = deadline_ms
+        self._schedule(key, deadline_ms)
+
+    def _clear_expiry(self, key):
+        """Removes a key's deadline, leaving its wheel entry to go stale. Returns the deadline, or None if it had none."""
+        return self._expirations.pop(key, None)
 
     def _check_expiry(self, key):
         """Checks if a key has expired and deletes it if necessary. Returns True if expired, False otherwise."""
-        if key in self._expirations:
-            if self._expirations[key] < time.time():
-                print(f"Key '{key}' expired, deleting.")
-                self._delete_key_internal(key)
+        expirations = self._expirations
+        if expirations:
+            deadline_ms = expirations.get(key)
+            if deadline_ms is not None and deadline_ms < self._now_ms():
+                self._expire_key(key)
                 return True
         return False
 
+    def _expire_key(self, key):
+        """Deletes a key whose deadline has passed. Call with the key's stripe held."""
+        if __debug__:
+            log.debug("Key '%s' expired, deleting.", key)
+        del self._data[key]
+        self._clear_expiry(key)
+        self._log("DEL", key)
+
     def _delete_key_internal(self, key):
         """Internal helper to delete a key and its expiry."""
-        deleted = False
-        if key in self._data:
-            del self._data[key]
-            deleted = True
-        if key in self._expirations:
-            del self._expirations[key]
-        return deleted
+        self._clear_expiry(key)
+        # Stored values are never None, so a None pop means the key was absent.
+        return self._data.pop(key, None) is not None
 
     def _get_value_or_error(self, key, expected_type=None):
-        """Helper to get a value, checking expiry and optionally type."""
-        if self._check_expiry(key):
-            return None, None
-
+        """Helper to get a value, checking expiry and optionally type. Returns (value, None), (None, None) for a missing key, or (None, error result)."""
+        # Same order as GET: a missing key costs one probe, and a live key
+        # one into each dict (none into _expirations while it is empty).
         value = self._data.get(key)
         if value is None:
             return None, None
+        expirations = self._expirations
+        if expirations and (deadline := expirations.get(key)) is not None and deadline < self._now_ms():
+            self._expire_key(key)
+            return None, None
 
-        if expected_type is not None and not isinstance(value, expected_type):
-            error_msg = f"WRONGTYPE Operation against a key holding the wrong kind of value"
-            print(f"Error for key '{key}': {error_msg}")
-            return None, error_msg
+        # Values are always exactly str, deque or dict, so the value's type
+        # pointer serves as its type tag: one identity compare, no isinstance.
+        if expected_type is not None and type(value) is not expected_type:
+            log.debug("Error for key '%s': %s", key, _ERR_WRONGTYPE)
+            return None, _ERR_WRONGTYPE
 
         return value, None
 
     def command_set(self, key, value, expire_ms=None):
-        """Sets a key-value pair (string). Overwrites existing keys of any type."""
-        print(f"Executing: SET {key} {value}" + (f" EX {expire_ms}" if expire_ms else ""))
-
-        self._data[key] = str(value)
+        """Sets a key-value pair (string). Overwrites existing keys of any type. With expire_ms, same as command_set_ex."""
         if expire_ms is not None:
+            return self.command_set_ex(key, value, expire_ms)
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: SET %s %s", key, value)
+
+            # Parsed arguments are already str; only other callers' values need converting.
+            value = self._data[key] = value if type(value) is str else str(value)
+            self._log("SET", key, value)
+            # A plain SET drops any TTL, without probing while no key has one.
+            expirations = self._expirations
+            if expirations and expirations.pop(key, None) is not None:
+                if __debug__:
+                    log.debug("Removed expiration for key '%s'", key)
+            return OK
+
+    def command_set_ex(self, key, value, expire_ms):
+        """Sets a key-value pair (string) that expires after expire_ms milliseconds. Overwrites existing keys of any type."""
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: SET %s %s (EX %s)", key, value, expire_ms)
+
+            value = self._data[key] = value if type(value) is str else str(value)
+            self._log("SET", key, value)
             try:
-                expire_seconds = int(expire_ms) / 1000.0
-                if expire_seconds <= 0:
-                     print(f"Error: Invalid expiration time '{expire_ms}'. Must be positive.")
+                expire_ms = int(expire_ms)
+                if expire_ms <= 0:
+                     log.debug("Error: Invalid expiration time '%s'. Must be positive.", expire_ms)
                      self._delete_key_internal(key)
-                     return "ERROR: Invalid expiration time format."
-
-                expiry_timestamp = time.time() + expire_seconds
-                self._expirations[key] = expiry_timestamp
-                print(f"Key '{key}' will expire at timestamp {expiry_timestamp}")
-            except ValueError:
-                 print(f"Error: Invalid expiration time format '{expire_ms}'. SET failed.")
+                     self._log("DEL", key)
+                     return _ERR_EXPIRE_FORMAT
+
+                deadline_ms = self._now_ms() + expire_ms
+                self._set_expiry(key, deadline_ms)
+                self._log_deadline(key, deadline_ms)
+                if __debug__:
+                    log.debug("Key '%s' will expire at %s ms", key, deadline_ms)
+            except (ValueError, OverflowError):
+                 log.debug("Error: Invalid expiration time format '%s'. SET failed.", expire_ms)
                  self._delete_key_internal(key)
-                 return "ERROR: Invalid expiration time format."
-        elif key in self._expirations:
-             del self._expirations[key]
-             print(f"Removed expiration for key '{key}'")
-
-        return "OK"
+                 self._log("DEL", key)
+                 return _ERR_EXPIRE_FORMAT
+            return OK
+
+    def _build_get(self):
+        """Builds the body of GET as a closure over the store, its clock and its expiry helper, so the unlocked hot path skips the method dispatch. Callers hold the key's stripe where the store has locks."""
+        store = self
+        now_ms = self._now_ms
+        expire_key = self._expire_key
+
+        def get(key):
+            if __debug__:
+                log.debug("Executing: GET %s", key)
+            # Expiry is checked inline: one probe into each dict for the
+            # common case of a live key, and none into _expirations when no
+            # key has a TTL (an empty dict is falsy, a C-level size check).
+            # The dicts are read through the store on each call, since
+            # restore() replaces them.
+            value = store._data.get(key)
+            if value is None:
+                return None
+            expirations = store._expirations
+            if expirations and (deadline := expirations.get(key)) is not None and deadline < now_ms():
+                expire_key(key)
+                return None
+            if type(value) is not str:
+                log.debug("Error for key '%s': %s", key, _ERR_WRONGTYPE)
+                return _ERR_WRONGTYPE
+            if __debug__:
+                log.debug("Retrieved: %s", value)
+            return value
+        return get
 
     def command_get(self, key):
         """Gets the value associated with a key (string)."""
-        print(f"Executing: GET {key}")
-        value, error = self._get_value_or_error(key, expected_type=str)
-        if error:
-            return f"ERROR: {error}"
-        print(f"Retrieved: {value}")
-        return value
+        with self._lock_for(key):
+            return self._get(key)
+
+    def make_get(self):
+        """Returns a GET function for this store with the same results and traces as command_get. A single-threaded store's is the unlocked GET body itself."""
+        return self.command_get if self._thread_safe else self._get
+
+    def command_mset(self, *pairs):
+        """Sets several key-value pairs (strings) given as key1 value1 key2 value2 ..., like SET on each."""
+        if not pairs or len(pairs) % 2:
+            log.debug("Error: MSET requires key-value pairs.")
+            return _ERR_MSET_ARGS
+        keys = pairs[::2]
+        with self._locked_keys(keys):
+            if __debug__:
+                log.debug("Executing: MSET %s", pairs)
+            # One C-level update for the whole batch. Like SET without EX,
+            # MSET leaves the keys without a TTL.
+            self._data.update(zip(keys, [value if type(value) is str else str(value) for value in pairs[1::2]]))
+            expirations = self._expirations
+            if expirations:
+                for key in keys:
+                    expirations.pop(key, None)
+            self._log("MSET", *pairs)
+            return OK
+
+    def command_mget(self, *keys):
+        """Gets the values of several keys (strings). Missing, expired and non-string keys give None."""
+        with self._locked_keys(keys):
+            if __debug__:
+                log.debug("Executing: MGET %s", keys)
+            # The clock is read once for the batch, and not at all while no
+            # key has a TTL.
+            data = self._data
+            expirations = self._expirations
+            now_ms = self._now_ms() if expirations else 0
+            values = []
+            for key in keys:
+                value = data.get(key)
+                if value is not None and expirations and (deadline := expirations.get(key)) is not None and deadline < now_ms:
+                    self._expire_key(key)
+                    value = None
+                values.append(value if type(value) is str else None)
+            return values
 
     def command_del(self, *keys):
         """Deletes one or more keys."""
-        print(f"Executing: DEL {' '.join(keys)}")
-        deleted_count = 0
-        for key in keys:
-             self._check_expiry(key)
-             if self._delete_key_internal(key):
-                 deleted_count += 1
-                 print(f"Deleted key '{key}'")
-             else:
-                 print(f"Key '{key}' not found for deletion.")
-        return deleted_count
-    def command_lpush(self, key, *values):
-        """Prepends one or multiple values to a list. Creates list if key doesn't exist."""
-        print(f"Executing: LPUSH {key} {' '.join(values)}")
-        if not values:
-             print("Error: LPUSH requires at least one value.")
-             return "ERROR: wrong number of arguments for 'lpush' command"
-        if self._check_expiry(key):
-            self._data[key] = deque(values)
-            if key in self._expirations: del self._expirations[key]
-            print(f"Created new list for key '{key}' after expiry.")
-            return len(values)
-
-        current_value = self._data.get(key)
+        with self._locked_keys(keys):
+            if __debug__:
+                log.debug("Executing: DEL %s", keys)
+            # The keys present are found with one C-level set intersection
+            # (dict_keys & tuple probes the dict once per argument), and
+            # only those that also have a TTL are checked against the clock.
+            data = self._data
+            existing = data.keys() & keys
+            if not existing:
+                return 0
+            deleted_count = len(existing)
+            expirations = self._expirations
+            if expirations:
+                now_ms = self._now_ms()
+                for key in expirations.keys() & existing:
+                    if expirations.pop(key) < now_ms:
+                        # Already expired: removed, but not counted as deleted.
+                        deleted_count -= 1
+            for key in existing:
+                del data[key]
+            if __debug__:
+                log.debug("Deleted %s of %s keys.", deleted_count, len(keys))
+            self._log("DEL", *keys)
+            return deleted_count
+
+    def _push(self, command, key, values, left):
+        """Shared body of LPUSH and RPUSH: creates the list, or adds the values at its head or tail. Call with the key's stripe held."""
+        # A missing or expired key (whose TTL went with it) gets a fresh list
+        # without any further probe of _expirations.
+        current_value, error = self._get_value_or_error(key, expected_type=deque)
+        if error:
+            return error
         if current_value is None:
             self._data[key] = deque(values)
-            if key in self._expirations: del self._expirations[key]
-            print(f"Created new list for key '{key}'.")
-            return len(values)
-        elif isinstance(current_value, deque):
-            for value in reversed(values):
-                current_value.appendleft(value)
-            print(f"Prepended {len(values)} values to list '{key}'.")
-            return len(current_value)
+            if __debug__:
+                log.debug("Created new list for key '%s'.", key)
+            length = len(values)
+        elif left:
+            # extendleft prepends one at a time, so it is fed the values
+            # reversed to keep them in the order given, like this store's
+            # LPUSH always has.
+            current_value.extendleft(reversed(values))
+            if __debug__:
+                log.debug("Prepended %s values to list '%s'.", len(values), key)
+            length = len(current_value)
         else:
-            error_msg = "WRONGTYPE Operation against a key holding the wrong kind of value"
-            print(f"Error for key '{key}': {error_msg}")
-            return f"ERROR: {error_msg}"
+            current_value.extend(values)
+            if __debug__:
+                log.debug("Appended %s values to list '%s'.", len(values), key)
+            length = len(current_value)
+        self._log(command, key, *values)
+        return length
+
+    def command_lpush(self, key, *values):
+        """Prepends one or multiple values to a list. Creates list if key doesn't exist."""
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: LPUSH %s %s", key, values)
+            if not values:
+                 log.debug("Error: LPUSH requires at least one value.")
+                 return _ERR_LPUSH_ARGS
+            return self._push("LPUSH", key, values, left=True)
 
     def command_rpush(self, key, *values):
         """Appends one or multiple values to a list. Creates list if key doesn't exist."""
-        print(f"Executing: RPUSH {key} {' '.join(values)}")
-        if not values:
-             print("Error: RPUSH requires at least one value.")
-             return "ERROR: wrong number of arguments for 'rpush' command"
-
-        if self._check_expiry(key):
-            self._data[key] = deque(values)
-            if key in self._expirations: del self._expirations[key]
-            print(f"Created new list for key '{key}' after expiry.")
-            return len(values)
-
-        current_value = self._data.get(key)
-        if current_value is None:
-            self._data[key] = deque(values)
-            if key in self._expirations: del self._expirations[key]
-            print(f"Created new list for key '{key}'.")
-            return len(values)
-        elif isinstance(current_value, deque):
-            for value in values:
-                current_value.append(value)
-            print(f"Appended {len(values)} values to list '{key}'.")
-            return len(current_value)
-        else:
-            error_msg = "WRONGTYPE Operation against a key holding the wrong kind of value"
-            print(f"Error for key '{key}': {error_msg}")
-            return f"ERROR: {error_msg}"
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: RPUSH %s %s", key, values)
+            if not values:
+                 log.debug("Error: RPUSH requires at least one value.")
+                 return _ERR_RPUSH_ARGS
+            return self._push("RPUSH", key, values, left=False)
 
     def command_lrange(self, key, start_str, stop_str):
         """Returns a range of elements from a list."""
-        print(f"Executing: LRANGE {key} {start_str} {stop_str}")
-        try:
-            start = int(start_str)
-            stop = int(stop_str)
-        except ValueError:
-            print("Error: start and stop indices must be integers.")
-            return "ERROR: value is not an integer or out of range"
-
-        value, error = self._get_value_or_error(key, expected_type=deque)
-        if error:
-            return f"ERROR: {error}"
-        if value is None:
-             print(f"List '{key}' not found or expired.")
-             return []
-
-        list_len = len(value)
-        if stop < 0:
-            stop = list_len + stop
-        adjusted_stop = stop + 1
-
-        # Handle edge cases and slice calculation carefully
-        # Redis LRANGE examples:
-        # LRANGE mylist 0 -1 => Get all elements
-        # LRANGE mylist 0 0 => Get first element
-        # LRANGE mylist -1 -1 => Get last element
-        # LRANGE mylist -2 -1 => Get last two elements
-
-        # Python slicing handles most cases naturally:
-        # list[0:] gets all from start
-        # list[:5] gets first 5 (0 to 4)
-        # list[-1:] gets last element
-        # list[-2:] gets last two elements
-
-        # Lets convert to Python slice indices
-        py_start = start
-        py_end = adjusted_stop
-
-        # Handle LRANGE mylist 0 -1 (get all)
-        if start == 0 and stop == -1:
-             py_end = None
-
-        # Ensure indices are within reasonable bounds for slicing if needed,
-        # although Python slicing is quite forgiving.
-        # Example: If list has 5 items (len=5, indices 0-4)
-        # LRANGE mylist 0 2 => Python slice [0:3] -> items 0, 1, 2
-        # LRANGE mylist -2 -1 => Python slice [-2:] -> items 3, 4
-
-        sliced_list = list(value)[py_start:py_end]
-        print(f"Retrieved range [{start}:{stop}]: {sliced_list}")
-        return sliced_list
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: LRANGE %s %s %s", key, start_str, stop_str)
+            try:
+                start = int(start_str)
+                stop = int(stop_str)
+            except ValueError:
+                log.debug("Error: start and stop indices must be integers.")
+                return _ERR_NOT_INTEGER
+
+            value, error = self._get_value_or_error(key, expected_type=deque)
+            if error:
+                return error
+            if value is None:
+                 if __debug__:
+                     log.debug("List '%s' not found or expired.", key)
+                 return []
+
+            # Redis indices are inclusive and may count from the end (-1 is
+            # the last element). Normalized to a forward range, islice walks
+            # from whichever end is nearer the range instead of copying the
+            # whole deque, so LRANGE -2 -1 costs two steps on any list.
+            list_len = len(value)
+            if start < 0:
+                start = max(0, list_len + start)
+            if stop < 0:
+                stop = list_len + stop
+            stop = min(stop, list_len - 1)
+            if start > stop:
+                return []
+            if start == 0 and stop == list_len - 1:
+                # The whole list (e.g. LRANGE 0 -1): list() copies the deque
+                # block by block, without stepping an islice iterator.
+                sliced_list = list(value)
+            elif start > list_len - 1 - stop:
+                sliced_list = list(islice(reversed(value), list_len - 1 - stop, list_len - start))
+                sliced_list.reverse()
+            else:
+                sliced_list = list(islice(value, start, stop + 1))
+            if __debug__:
+                log.debug("Retrieved range [%s:%s]: %s", start, stop, sliced_list)
+            return sliced_list
 
     def command_ttl(self, key):
         """Returns the remaining time to live of a key that has a timeout."""
-        print(f"Executing: TTL {key}")
-        if key not in self._data:
-            print(f"Key '{key}' does not exist.")
-            return -2
-
-        if self._check_expiry(key):
-             print(f"Key '{key}' expired just now.")
-             return -2
-        if key in self._expirations:
-            remaining_time = self._expirations[key] - time.time()
-            if remaining_time > 0:
-                print(f"Key '{key}' has {int(remaining_time)} seconds remaining.")
-                return int(remaining_time)
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: TTL %s", key)
+            # The deadline is probed first: only keys in _data have one, so
+            # a key with a TTL costs a single probe, and one without costs
+            # the membership test (plus the get while any key has a TTL).
+            expirations = self._expirations
+            deadline = expirations.get(key) if expirations else None
+            if deadline is None:
+                if key not in self._data:
+                    if __debug__:
+                        log.debug("Key '%s' does not exist.", key)
+                    return -2
+                if __debug__:
+                    log.debug("Key '%s' has no expiration set.", key)
+                return -1
+            remaining_ms = deadline - self._now_ms()
+            if remaining_ms > 0:
+                if __debug__:
+                    log.debug("Key '%s' has %s seconds remaining.", key, remaining_ms // 1000)
+                return remaining_ms // 1000
+            if remaining_ms < 0:
+                self._expire_key(key)
+                if __debug__:
+                    log.debug("Key '%s' expired just now.", key)
             else:
-                 print(f"Key '{key}' expiration time is in the past (but not yet cleaned).")
-                 return -2
-        else:
-            print(f"Key '{key}' has no expiration set.")
-            return -1
+                if __debug__:
+                    log.debug("Key '%s' expiration time is in the past (but not yet cleaned).", key)
+            return -2
 
     def command_expire(self, key, seconds):
         """Sets an expiration time on a key in seconds."""
-        print(f"Executing: EXPIRE {key} {seconds}")
-        if key not in self._data:
-             print(f"Key '{key}' does not exist. Cannot set expiry.")
-             return 0
-        if self._check_expiry(key):
-            print(f"Key '{key}' expired just before EXPIRE command.")
-            return 0
-        try:
-            expire_seconds = int(seconds)
-            if expire_seconds <= 0:
-                print(f"Expiration seconds must be positive. Removing expiry for '{key}' if it exists.")
-                removed = 0
-                if key in self._expirations:
-                    del self._expirations[key]
-                    removed = 1
-                return removed
-            else:
-                expiry_timestamp = time.time() + expire_seconds
-                self._expirations[key] = expiry_timestamp
-                print(f"Set expiration for key '{key}' to {expire_seconds} seconds from now (timestamp: {expiry_timestamp}).")
-                return 1
-        except ValueError:
-            print(f"Error: Invalid seconds value '{seconds}'.")
-            return 0
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: EXPIRE %s %s", key, seconds)
+            if key not in self._data:
+                 if __debug__:
+                     log.debug("Key '%s' does not exist. Cannot set expiry.", key)
+                 return 0
+            now_ms = self._now_ms()
+            expirations = self._expirations
+            deadline = expirations.get(key) if expirations else None
+            if deadline is not None and deadline < now_ms:
+                self._expire_key(key)
+                if __debug__:
+                    log.debug("Key '%s' expired just before EXPIRE command.", key)
+                return 0
+            try:
+                expire_seconds = int(seconds)
+                if expire_seconds <= 0:
+                    if __debug__:
+                        log.debug("Expiration seconds must be positive. Removing expiry for '%s' if it exists.", key)
+                    removed = 0
+                    if self._clear_expiry(key) is not None:
+                        self._log("EXPIRE", key, expire_seconds)
+                        removed = 1
+                    return removed
+                else:
+                    deadline_ms = now_ms + expire_seconds * 1000
+                    self._set_expiry(key, deadline_ms)
+                    self._log_deadline(key, deadline_ms)
+                    if __debug__:
+                        log.debug("Set expiration for key '%s' to %s seconds from now (deadline: %s ms).", key, expire_seconds, deadline_ms)
+                    return 1
+            except (ValueError, OverflowError):
+                log.debug("Error: Invalid seconds value '%s'.", seconds)
+                return 0
+
+    def command_pexpireat(self, key, unix_time_ms):
+        """Sets a key's expiry to an absolute Unix time in milliseconds. Used to replay the append-only log."""
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: PEXPIREAT %s %s", key, unix_time_ms)
+            if key not in self._data or self._check_expiry(key):
+                return 0
+            try:
+                deadline_ms = int(unix_time_ms) - _wall_clock_offset_ms()
+                self._set_expiry(key, deadline_ms)
+            except (ValueError, OverflowError):
+                log.debug("Error: Invalid timestamp '%s'.", unix_time_ms)
+                return 0
+            self._log_deadline(key, deadline_ms)
+            return 1
 
     def command_hset(self, key, field, value):
         """Sets the value of a field in a hash stored at key."""
-        print(f"Executing: HSET {key} {field} {value}")
-
-        if self._check_expiry(key):
-            self._data[key] = {field: value}
-            if key in self._expirations: del self._expirations[key]
-            print(f"Created new hash for key '{key}' after expiry.")
-            return 1
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: HSET %s %s %s", key, field, value)
+
+            if self._check_expiry(key):
+                # _expire_key has already removed the deadline.
+                self._data[key] = {field: value}
+                if __debug__:
+                    log.debug("Created new hash for key '%s' after expiry.", key)
+                self._log("HSET", key, field, value)
+                return 1
 
-        current_value = self._data.get(key)
-        if current_value is None:
-            self._data[key] = {field: value}
-            if key in self._expirations: del self._expirations[key]
-            print(f"Created new hash for key '{key}'.")
-            return 1
-        elif isinstance(current_value, dict):
-            is_new_field = field not in current_value
-            current_value[field] = value
-            print(f"Set field '{field}' in hash '{key}'. New field: {is_new_field}")
-            return 1 if is_new_field else 0
-        else:
-            error_msg = "WRONGTYPE Operation against a key holding the wrong kind of value"
-            print(f"Error for key '{key}': {error_msg}")
-            return f"ERROR: {error_msg}"
+            current_value = self._data.get(key)
+            if current_value is None:
+                # A missing key never has a deadline.
+                self._data[key] = {field: value}
+                if __debug__:
+                    log.debug("Created new hash for key '%s'.", key)
+                self._log("HSET", key, field, value)
+                return 1
+            elif type(current_value) is dict:
+                # The size grows only if the field is new: one hash probe
+                # instead of a membership test plus the store.
+                size = len(current_value)
+                current_value[field] = value
+                is_new_field = len(current_value) != size
+                if __debug__:
+                    log.debug("Set field '%s' in hash '%s'. New field: %s", field, key, is_new_field)
+                self._log("HSET", key, field, value)
+                return 1 if is_new_field else 0
+            else:
+                log.debug("Error for key '%s': %s", key, _ERR_WRONGTYPE)
+                return _ERR_WRONGTYPE
 
     def command_hget(self, key, field):
         """Gets the value of a field in a hash stored at key."""
-        print(f"Executing: HGET {key} {field}")
-
-        value, error = self._get_value_or_error(key, expected_type=dict)
-        if error:
-            return f"ERROR: {error}"
-        if value is None:
-            print(f"Hash '{key}' not found or expired.")
-            return None
-
-        field_value = value.get(field, None)
-        print(f"Retrieved field '{field}' from hash '{key}': {field_value}")
-        return field_value
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: HGET %s %s", key, field)
+
+            value, error = self._get_value_or_error(key, expected_type=dict)
+            if error:
+                return error
+            if value is None:
+                if __debug__:
+                    log.debug("Hash '%s' not found or expired.", key)
+                return None
+
+            field_value = value.get(field, None)
+            if __debug__:
+                log.debug("Retrieved field '%s' from hash '%s': %s", field, key, field_value)
+            return field_value
 
     def command_hdel(self, key, *fields):
         """Deletes one or more fields from a hash stored at key."""
-        print(f"Executing: HDEL {key} {' '.join(fields)}")
-        if not fields:
-             print("Error: HDEL requires at least one field.")
-             return "ERROR: wrong number of arguments for 'hdel' command"
-
-        value, error = self._get_value_or_error(key, expected_type=dict)
-        if error:
-            return f"ERROR: {error}"
-        if value is None:
-            print(f"Hash '{key}' not found or expired. Cannot delete fields.")
-            return 0
-
-        deleted_count = 0
-        for field in fields:
-            if field in value:
-                del value[field]
-                deleted_count += 1
-                print(f"Deleted field '{field}' from hash '{key}'.")
-            else:
-                 print(f"Field '{field}' not found in hash '{key}'.")
-
-        if not value:
-            self._delete_key_internal(key)
-            print(f"Hash '{key}' became empty and was deleted.")
+        with self._lock_for(key):
+            if __debug__:
+                log.debug("Executing: HDEL %s %s", key, fields)
+            if not fields:
+                 log.debug("Error: HDEL requires at least one field.")
+                 return _ERR_HDEL_ARGS
+
+            value, error = self._get_value_or_error(key, expected_type=dict)
+            if error:
+                return error
+            if value is None:
+                if __debug__:
+                    log.debug("Hash '%s' not found or expired. Cannot delete fields.", key)
+                return 0
+
+            # One pop per field instead of a membership test plus a delete,
+            # and no per-field trace: the summary below covers the batch.
+            pop = value.pop
+            deleted_count = 0
+            for field in fields:
+                if pop(field, _MISSING) is not _MISSING:
+                    deleted_count += 1
+
+            if deleted_count:
+                self._log("HDEL", key, *fields)
+            if not value:
+                self._delete_key_internal(key)
+                if __debug__:
+                    log.debug("Hash '%s' became empty and was deleted.", key)
 
-        print(f"Deleted {deleted_count} fields from hash '{key}'.")
-        return deleted_count
+            if __debug__:
+                log.debug("Deleted %s fields from hash '%s'.", deleted_count, key)
+            return deleted_count
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
     store = PyRedisStore()
 
     print("\n--- Testing Basic Commands ---")
@@ -0,0 +1,113 @@
+import pytest
+import os
+import time
+from collections import deque
+from redis_aof import AppendOnlyLog, read_log
+from redis_protocol import encode_command
+from redis_store import PyRedisStore
+import redis_server
+
+@pytest.fixture
+def log_path(tmp_path):
+    """Provides a path for a fresh append-only log."""
+    return str(tmp_path / "test.aof")
+
+def replay(store, path):
+    """Applies every logged command to the store."""
+    for name, *args in read_log(path):
+        getattr(store, "command_" + name.lower())(*args)
+
+# --- Log File Tests ---
+
+def test_append_and_read(log_path):
+    """Test that appended commands are read back in order, and a torn final command is skipped."""
+    aof = AppendOnlyLog(log_path)
+    aof.append("SET", "k", "two words")
+    aof.append("DEL", "k")
+    aof.close()
+    with open(log_path, 'ab') as f:
+        f.write(b"*2\r\n$3\r\nDEL\r\n$1")
+    assert list(read_log(log_path)) == [["SET", "k", "two words"], ["DEL", "k"]]
+    assert os.path.getsize(log_path) == len(encode_command("SET", "k", "two words") + encode_command("DEL", "k"))
+
+def test_append_after_torn_command(log_path):
+    """Test that commands appended after replaying a torn log can be read back on the next replay."""
+    aof = AppendOnlyLog(log_path)
+    aof.append("SET", "a", "1")
+    aof.close()
+    with open(log_path, 'ab') as f:
+        f.write(b"*3\r\n$3\r\nSET\r\n$1")
+    assert list(read_log(log_path)) == [["SET", "a", "1"]]
+    aof = AppendOnlyLog(log_path)
+    aof.append("SET", "b", "2")
+    aof.close()
+    assert list(read_log(log_path)) == [["SET", "a", "1"], ["SET", "b", "2"]]
+
+def test_invalid_command_stops_replay(log_path):
+    """Test that replay stops cleanly at bytes that are not a command, keeping the commands before them."""
+    with open(log_path, 'wb') as f:
+        f.write(encode_command("SET", "a", "1") + b"*x\r\n" + encode_command("SET", "b", "2"))
+    assert list(read_log(log_path)) == [["SET", "a", "1"]]
+    assert list(read_log(log_path)) == [["SET", "a", "1"]]
+
+def test_truncate(log_path):
+    """Test that truncate empties the log and later commands follow."""
+    aof = AppendOnlyLog(log_path)
+    aof.append("SET", "a", "1")
+    aof.truncate()
+    aof.append("SET", "b", "2")
+    aof.close()
+    assert list(read_log(log_path)) == [["SET", "b", "2"]]
+
+# --- Store Logging Tests ---
+
+def test_replay_rebuilds_store(log_path):
+    """Test that replaying the store's log into an empty store reproduces its data and expiries."""
+    store = PyRedisStore()
+    aof = AppendOnlyLog(log_path)
+    store.attach_log(aof)
+    store.command_set("s", "v")
+    store.command_set("temp", "v", expire_ms="5000")
+    store.command_lpush("l", "a")
+    store.command_lpush("l", "b", "c")
+    store.command_rpush("l", "d")
+    store.command_hset("h", "f1", "v1")
+    store.command_hset("h", "f2", "v2")
+    store.command_hdel("h", "f1")
+    store.command_mset("m1", "v1", "m2", "v2")
+    store.command_set("gone", "v")
+    store.command_del("gone", "missing")
+    store.command_expire("s", "100")
+    store.command_set("expired", "v", expire_ms="50")
+    time.sleep(0.1)
+    assert store.command_get("expired") is None
+    aof.close()
+
+    replayed = PyRedisStore()
+    replay(replayed, log_path)
+    assert replayed._data == store._data
+    assert replayed.command_lrange("l", "0", "-1") == ["b", "c", "a", "d"]
+    assert 98 <= replayed.command_ttl("s") <= 100
+    assert 3 <= replayed.command_ttl("temp") <= 5
+
+# --- Server Replay Tests ---
+
+def test_server_replays_log(tmp_path, monkeypatch):
+    """Test that the server's replay dispatches logged commands without expiring keys mid-replay, and repairs a torn log."""
+    monkeypatch.chdir(tmp_path)
+    redis_server.store.restore({}, {})
+    past = time.time_ns() // 1_000_000 - 1000
+    with open(redis_server.AOF_FILENAME, 'wb') as f:
+        f.write(encode_command("RPUSH", "l", "a") + encode_command("PEXPIREAT", "l", past))
+        f.write(encode_command("RPUSH", "l", "b") + encode_command("set", "s", "v"))
+        f.write(b"*2\r\n$3\r\nDEL")
+    redis_server.load_log_from_disk()
+    assert redis_server.store._data == {"l": deque(["a", "b"]), "s": "v"}
+    assert redis_server.store.command_lrange("l", "0", "-1") == []
+
+    with open(redis_server.AOF_FILENAME, 'ab') as f:
+        f.write(encode_command("SET", "t", "w"))
+    redis_server.store.restore({}, {})
+    redis_server.load_log_from_disk()
+    assert redis_server.store._data == {"l": deque(["a", "b"]), "s": "v", "t": "w"}
+    redis_server.store.restore({}, {})
@@ -0,0 +1,86 @@
+import pytest
+from redis_protocol import (
+    RequestParser, ProtocolError, ErrorReply, encode_command, encode_inline_reply, encode_resp_reply,
+)
+
+def parse_all(*chunks):
+    """Feeds chunks one at a time and collects every request that becomes complete."""
+    parser = RequestParser()
+    requests = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        while (request := parser.next_request()) is not None:
+            requests.append(request)
+    return requests
+
+# --- Request Framing Tests ---
+
+def test_inline_commands():
+    """Test that inline lines are split on whitespace and blank lines are skipped."""
+    assert parse_all(b"SET k v\r\n\nGET  k\n") == [(["SET", "k", "v"], False), (["GET", "k"], False)]
+
+def test_resp_array():
+    """Test that RESP arguments keep spaces and newlines intact."""
+    frame = encode_command("SET", "k", "two words\r\nand a line")
+    assert parse_all(frame) == [(["SET", "k", "two words\r\nand a line"], True)]
+
+def test_resp_split_across_reads():
+    """Test a pipelined RESP stream delivered one byte at a time."""
+    stream = encode_command("SET", "k", "v") + encode_command("GET", "k")
+    chunks = [stream[i:i + 1] for i in range(len(stream))]
+    assert parse_all(*chunks) == [(["SET", "k", "v"], True), (["GET", "k"], True)]
+
+def test_bytes_needed_for_partial_bulk():
+    """Test that the parser reports how much of a half-received value is missing."""
+    parser = RequestParser()
+    parser.feed(b"*2\r\n$3\r\nGET\r\n$10\r\nabc")
+    assert parser.next_request() is None
+    assert parser.bytes_needed == 9
+    parser.feed(b"defghij\r\n")
+    assert parser.bytes_needed == 0
+    assert parser.next_request() == (["GET", "abcdefghij"], True)
+
+def test_mixed_framing():
+    """Test that RESP and inline requests can follow each other on one connection."""
+    assert parse_all(b"PING\n" + encode_command("PING")) == [(["PING"], False), (["PING"], True)]
+
+def test_binary_arguments_round_trip():
+    """Test that non-UTF-8 bytes survive decoding and re-encoding."""
+    frame = b"*2\r\n$3\r\nGET\r\n$2\r\n\xff\xfe\r\n"
+    [(args, _)] = parse_all(frame)
+    assert encode_resp_reply(args[1]) == b"$2\r\n\xff\xfe\r\n"
+
+def test_malformed_frames():
+    """Test that broken RESP headers raise ProtocolError."""
+    with pytest.raises(ProtocolError):
+        parse_all(b"*1\r\n#3\r\nGET\r\n")
+    with pytest.raises(ProtocolError):
+        parse_all(b"*x\r\n")
+    with pytest.raises(ProtocolError):
+        parse_all(b"*1\r\n$3\r\nGETXX")
+
+# --- Reply Encoding Tests ---
+
+def test_resp_replies():
+    """Test RESP encoding of each result type."""
+    assert encode_resp_reply("OK", status=True) == b"+OK\r\n"
+    assert encode_resp_reply("OK") == b"$2\r\nOK\r\n"
+    assert encode_resp_reply(None) == b"$-1\r\n"
+    assert encode_resp_reply(3) == b":3\r\n"
+    assert encode_resp_reply(["a", "bc"]) == b"*2\r\n$1\r\na\r\n$2\r\nbc\r\n"
+    assert encode_resp_reply(ErrorReply("ERROR: WRONGTYPE Operation")) == b"-WRONGTYPE Operation\r\n"
+    assert encode_resp_reply(ErrorReply("ERROR: Unknown command 'X'")) == b"-ERR Unknown command 'X'\r\n"
+
+def test_error_text_in_values():
+    """Test that stored values looking like errors are still sent as values, alone or inside arrays."""
+    assert encode_resp_reply("ERROR: hello") == b"$12\r\nERROR: hello\r\n"
+    assert encode_resp_reply(["ERROR: hello"]) == b"*1\r\n$12\r\nERROR: hello\r\n"
+    assert encode_resp_reply("ERROR: hello", status=True) == b"+ERROR: hello\r\n"
+
+def test_inline_replies():
+    """Test the text replies sent to inline clients."""
+    assert encode_inline_reply(None) == b"Nil\n"
+    assert encode_inline_reply(2) == b"(integer) 2\n"
+    assert encode_inline_reply(["a"]) == b"['a']\n"
+    assert encode_inline_reply("OK") == b"OK\n"
+    assert encode_inline_reply(ErrorReply("ERROR: oops")) == b"ERROR: oops\n"
@@ -1,12 +1,14 @@
 import pytest
 import time
 import os
-from redis_store import PyRedisStore
+import threading
+from redis_store import PyRedisStore, WHEEL_COMPACT_MIN, WHEEL_SLOTS
+from redis_protocol import ErrorReply
 
 @pytest.fixture
 def store():
     """Provides a clean PyRedisStore instance for each test."""
-    dump_file = "pyredis_dump.pkl"
+    dump_file = "pyredis_dump.json"
     if os.path.exists(dump_file):
         try:
             os.remove(dump_file)
@@ -36,21 +38,46 @@ def test_del_multiple_keys(store):
     assert store.command_get("key1") is None
     assert store.command_get("key2") is None
 
+    assert store.command_set("dup", "v") == "OK"
+    assert store.command_set("live", "v", expire_ms="5000") == "OK"
+    assert store.command_set("expired", "v", expire_ms="50") == "OK"
+    time.sleep(0.1)
+    assert store.command_del("dup", "dup", "live", "expired") == 2
+    assert store._data == {} and store._expirations == {}
+
 def test_set_overwrite(store):
     """Test that SET overwrites existing keys."""
     assert store.command_set("mykey", "value1") == "OK"
     assert store.command_get("mykey") == "value1"
     assert store.command_set("mykey", "value2") == "OK"
     assert store.command_get("mykey") == "value2"
+    assert store.command_set("mykey", 42) == "OK"
+    assert store.command_get("mykey") == "42"
+
+def test_mset_mget(store):
+    """Test MSET and MGET, including TTL removal, non-string keys and expired keys."""
+    assert store.command_set("a", "old", expire_ms="5000") == "OK"
+    assert store.command_mset("a", "1", "b", "2") == "OK"
+    assert store.command_ttl("a") == -1
+    assert store.command_mset("a", "1", "b").startswith("ERROR")
+    assert store.command_lpush("list", "x") == 1
+    assert store.command_set("temp", "v", expire_ms="50") == "OK"
+    time.sleep(0.1)
+    assert store.command_mget("a", "b", "missing", "list", "temp") == ["1", "2", None, None, None]
+    assert "temp" not in store._data
 
 # --- Expiration Tests ---
 
 def test_basic_expiry(store):
     """Test SET with EX and GET after expiration."""
     assert store.command_set("tempkey", "tempval", expire_ms="150") == "OK"
+    assert store.command_set_ex("tempkey2", "tempval", "150") == "OK"
     assert store.command_get("tempkey") == "tempval"
     time.sleep(0.2)
     assert store.command_get("tempkey") is None
+    assert store.command_get("tempkey2") is None
+    assert store.command_set_ex("tempkey2", "tempval", "soon").startswith("ERROR")
+    assert store.command_get("tempkey2") is None
 
 def test_ttl_command(store):
     """Test the TTL command."""
@@ -87,6 +114,82 @@ def test_expire_command(store):
     assert store.command_expire("key_rem_exp", "0") == 1
     assert store.command_ttl("key_rem_exp") == -1
 
+    assert store.command_expire("key_rem_exp", str(1 << 64)) == 0
+    assert store.command_ttl("key_rem_exp") == -1
+    assert store.command_set("key_rem_exp", "data", expire_ms=str(1 << 64)).startswith("ERROR")
+    assert store.command_set("key_rem_exp", "data") == "OK"
+    assert store.command_pexpireat("key_rem_exp", str(1 << 64)) == 0
+    assert store.command_ttl("key_rem_exp") == -1
+    assert all(len(keys) == len(deadlines) for keys, deadlines in store._wheel)
+
+def test_active_expire(store):
+    """Test that active expiry deletes untouched expired keys, within its budget."""
+    for i in range(5):
+        assert store.command_set(f"temp{i}", "v", expire_ms="100") == "OK"
+    assert store.command_set("stale", "v", expire_ms="100") == "OK"
+    assert store.command_set("stale", "v2") == "OK"
+    assert store.command_set("keeper", "v", expire_ms="5000") == "OK"
+    assert store.command_set("moved", "v", expire_ms="100") == "OK"
+    assert store.command_expire("moved", "5") == 1
+
+    assert store.active_expire() == 0
+    # The timing wheel sweeps whole seconds once they have passed.
+    time.sleep(1.15)
+    assert store.active_expire(budget=2) == 2
+    assert store.active_expire() == 3
+    assert "temp4" not in store._data
+    assert store.command_get("stale") == "v2"
+    assert store.command_ttl("keeper") > 0
+    assert store.command_ttl("moved") > 0
+
+def test_refreshed_ttls_do_not_pile_up_in_the_wheel(store):
+    """Test that refreshing a key's TTL many times leaves only a few wheel entries, one of them live."""
+    for _ in range(1000):
+        assert store.command_set("k", "v", expire_ms="600000") == "OK"
+        assert store.command_expire("k", "600") == 1
+    entries = [(key, deadline) for keys, deadlines in store._wheel for key, deadline in zip(keys, deadlines)]
+    assert len(entries) <= 4 * WHEEL_COMPACT_MIN # Two slots at most if a second boundary passes
+    assert ("k", store._expirations["k"]) in entries
+
+def test_sweep_keeps_later_lap_entries(store):
+    """Test that sweeping a slot holding more than WHEEL_SLOTS entries due on a later lap keeps them and resets only that slot's limit."""
+    now_ms = store._now_ms()
+    with store.tick(now_ms=now_ms):
+        for i in range(WHEEL_SLOTS + 1000):
+            assert store.command_set_ex(f"k{i}", "v", str((WHEEL_SLOTS + 1) * 1000)) == "OK"
+    swept = (store._expirations["k0"] // 1000) & (WHEEL_SLOTS - 1)
+    untouched = (swept + WHEEL_SLOTS // 2) & (WHEEL_SLOTS - 1)
+    with store.tick(now_ms=now_ms + 3000):
+        assert store.active_expire() == 0
+    keys, deadlines = store._wheel[swept]
+    assert len(keys) == len(deadlines) == WHEEL_SLOTS + 1000
+    assert store._wheel_limits[swept] == 2 * (WHEEL_SLOTS + 1000)
+    assert store._wheel_limits[untouched] == WHEEL_COMPACT_MIN
+
+def test_tick_pins_clock(store):
+    """Test that expiry checks inside a tick see the time the tick started."""
+    assert store.command_set("temp", "v", expire_ms="100") == "OK"
+    with store.tick():
+        time.sleep(0.15)
+        assert store.command_get("temp") == "v"
+    assert store.command_get("temp") is None
+
+def test_restore_converts_wall_clock_expirations(store):
+    """Test that persisted Unix-time deadlines survive a save/restore round trip."""
+    now_ms = int(time.time() * 1000)
+    store.restore({"live": "v", "dead": "v"}, {"live": now_ms + 5000, "dead": now_ms - 1000})
+    assert store.command_get("dead") is None
+    assert 3 <= store.command_ttl("live") <= 5
+    saved = store.wall_clock_expirations()
+    assert list(saved) == ["live"]
+    assert abs(saved["live"] - (now_ms + 5000)) < 50
+
+    store.restore({"big": "v", "ancient": "v", "live": "v"}, {"big": 1 << 64, "ancient": -(1 << 64), "live": now_ms + 5000})
+    assert store.command_ttl("big") == -1
+    assert store.command_get("ancient") is None
+    assert 3 <= store.command_ttl("live") <= 5
+    assert all(len(keys) == len(deadlines) for keys, deadlines in store._wheel)
+
 # --- List Command Tests ---
 
 def test_list_lpush_lrange(store):
@@ -97,6 +200,9 @@ def test_list_lpush_lrange(store):
     assert store.command_lrange("mylist", "0", "-1") == ["b", "c", "a"]
     assert store.command_lrange("mylist", "-2", "-1") == ["c", "a"]
     assert store.command_lrange("mylist", "5", "10") == []
+    assert store.command_lrange("mylist", "-10", "1") == ["b", "c"]
+    assert store.command_lrange("mylist", "0", "-5") == []
+    assert store.command_lrange("mylist", "2", "1") == []
     assert store.command_lrange("nonexistent_list", "0", "-1") == []
 
 def test_list_rpush(store):
@@ -104,6 +210,10 @@ def test_list_rpush(store):
     assert store.command_rpush("mylist", "a") == 1
     assert store.command_rpush("mylist", "b", "c") == 3
     assert store.command_lrange("mylist", "0", "-1") == ["a", "b", "c"]
+    assert store.command_rpush("long", *map(str, range(1000))) == 1000
+    assert store.command_lrange("long", "-3", "-1") == ["997", "998", "999"]
+    assert store.command_lrange("long", "990", "992") == ["990", "991", "992"]
+    assert store.command_lrange("long", "1", "2") == ["1", "2"]
 
 def test_list_expiry(store):
     """Test expiration on list keys."""
@@ -179,3 +289,55 @@ def test_wrong_type_operations(store):
     assert hset_str_result == WRONGTYPE_ERROR_PREFIX
     hget_list_result = store.command_hget("mylist", "f1")
     assert hget_list_result == WRONGTYPE_ERROR_PREFIX
+    assert type(hget_list_result) is ErrorReply
+
+    assert store.command_set("looks_like_error", "ERROR: hello") == "OK"
+    assert type(store.command_get("looks_like_error")) is str
+
+# --- Concurrency Tests ---
+
+def test_single_threaded_store():
+    """Test that a store without locks runs commands the same way."""
+    store = PyRedisStore(thread_safe=False)
+    assert store.command_set("k", "v", expire_ms="5000") == "OK"
+    assert store.command_rpush("l", "a", "b") == 2
+    assert store.command_del("k", "l", "missing") == 2
+    assert store.active_expire() == 0
+    with store.locked():
+        assert store._data == {}
+
+def test_make_get(store):
+    """Test that the specialized GET matches command_get, including after restore replaces the dicts."""
+    assert store.make_get() == store.command_get
+    single = PyRedisStore(thread_safe=False)
+    get = single.make_get()
+    assert single.command_set("k", "v") == "OK"
+    assert single.command_lpush("l", "a") == 1
+    assert single.command_set("temp", "v", expire_ms="50") == "OK"
+    assert get("k") == "v"
+    assert get("missing") is None
+    assert get("l") == single.command_get("l")
+    time.sleep(0.1)
+    assert get("temp") is None
+    assert "temp" not in single._data
+    single.restore({"new": "value"}, {})
+    assert get("new") == "value"
+    assert get("k") is None
+
+def test_concurrent_pushes_are_not_lost(store):
+    """Test that threads pushing to shared and private keys don't lose updates."""
+    def worker(n):
+        for i in range(200):
+            store.command_rpush("shared", str(i))
+            store.command_rpush(f"own:{n}", str(i))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(store.command_lrange("shared", "0", "-1")) == 800
+    for n in range(4):
+        assert len(store.command_lrange(f"own:{n}", "0", "-1")) == 200
+    assert store.command_del("shared", "own:0", "own:1") == 3